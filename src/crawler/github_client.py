@@ -1,9 +1,124 @@
-import requests
+import httpx
+import orjson
+import asyncio
+import hashlib
+import logging
+import random
 import time
-from typing import List, Dict, Optional
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
 import sys
 
-class GitHubGraphQLClient:
+from .rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# How many GraphQL requests may be in flight at once.
+# GitHub bans clients that hammer it with concurrent requests
+# (secondary rate limits), so keep this modest.
+ASYNC_CONCURRENCY = 10
+
+# Below this many points left, requests are paced so the rest of the
+# budget lasts until GitHub's resetAt (see TokenBucket)
+LOW_BUDGET = 500
+
+# Automatic persisted queries (send a hash instead of the query text).
+# GitHub does not support APQ yet, so this is off by default.
+USE_PERSISTED_QUERIES = False
+
+RATE_LIMIT_QUERY = """
+query {
+  rateLimit {
+    limit
+    remaining
+    resetAt
+    cost
+  }
+}
+"""
+
+# Fields we store for every repository.
+# Only what the database needs: no node `id` (we key on databaseId) and
+# no nested `owner { login }` (the owner is the prefix of nameWithOwner).
+REPOSITORY_FIELDS = """
+        databaseId
+        name
+        nameWithOwner
+        stargazerCount
+        createdAt
+        updatedAt
+"""
+
+
+@lru_cache(maxsize=None)
+def query_hash(query: str) -> str:
+    """SHA-256 of a query, as used by automatic persisted queries."""
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def build_search_batch_query(count: int) -> str:
+    """
+    Build one GraphQL document holding `count` aliased searches.
+    
+    Why aliases?
+    - GitHub allows many top-level fields in one request
+    - search0, search1, ... each get their own query string and cursor
+    - One HTTP round-trip instead of `count` (same point cost)
+    
+    Cached, so each document is built once per alias count instead of
+    on every request.
+    """
+    params = ", ".join(f"$query{i}: String!, $cursor{i}: String" for i in range(count))
+    searches = "".join(f"""
+  search{i}: search(query: $query{i}, type: REPOSITORY, first: $batch_size, after: $cursor{i}) {{
+    pageInfo {{
+      hasNextPage
+      endCursor
+    }}
+    nodes {{
+      ... on Repository {{{REPOSITORY_FIELDS}      }}
+    }}
+  }}""" for i in range(count))
+    
+    return f"""
+query({params}, $batch_size: Int!) {{{searches}
+  rateLimit {{
+    remaining
+    resetAt
+    cost
+  }}
+}}
+"""
+
+
+@lru_cache(maxsize=None)
+def build_count_batch_query(count: int) -> str:
+    """
+    Build one GraphQL document counting results of `count` aliased searches.
+    
+    Only repositoryCount is selected, so no repository data is transferred.
+    Cached like build_search_batch_query.
+    """
+    params = ", ".join(f"$query{i}: String!" for i in range(count))
+    searches = "".join(f"""
+  count{i}: search(query: $query{i}, type: REPOSITORY, first: 1) {{
+    repositoryCount
+  }}""" for i in range(count))
+    
+    return f"""
+query({params}) {{{searches}
+  rateLimit {{
+    remaining
+    resetAt
+    cost
+  }}
+}}
+"""
+
+
+class AsyncGitHubGraphQLClient:
     """
     Client for GitHub's GraphQL API.
     
@@ -11,9 +126,20 @@ class GitHubGraphQLClient:
     - Fetch multiple fields in one request (repo + stars + owner)
     - Better rate limits (5000 points/hour vs 5000 requests/hour)
     - Cursor-based pagination (handles millions of results)
+    
+    Why async?
+    - Crawling is I/O-bound: most time is spent waiting on GitHub
+    - Many requests can be in flight at once, so latencies overlap
+    - Over HTTP/2 they are multiplexed on one TLS connection
+    - A semaphore caps in-flight requests to avoid secondary rate limits
+    
+    Usage:
+        async with AsyncGitHubGraphQLClient(token) as client:
+            response = await client.fetch_repository_batch(searches)
     """
     
-    def __init__(self, token: str):
+    def __init__(self, token: str, concurrency: int = ASYNC_CONCURRENCY,
+                 persisted_queries: bool = USE_PERSISTED_QUERIES):
         """
         Initialize with GitHub token.
         
@@ -21,6 +147,11 @@ class GitHubGraphQLClient:
         - Authentication
         - Higher rate limits
         - Access to API
+        
+        concurrency: How many requests may be in flight at once.
+        
+        persisted_queries: Send only the query's hash, and the full text
+        only when the server does not know it yet (Apollo-style APQ).
         """
         if not token:
             raise ValueError("GitHub token is required!")
@@ -29,59 +160,142 @@ class GitHubGraphQLClient:
         self.endpoint = "https://api.github.com/graphql"
         self.headers = {
             "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            # GraphQL JSON compresses ~85-90%; brotli/zstd decoders are optional
+            "Accept-Encoding": "gzip, br, zstd"
         }
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session: Optional[httpx.AsyncClient] = None  # Opened by `async with`
+        # Sized for a personal token until check_rate_limit() reports the real limit
+        # (e.g. 1000 points/hour for an Actions GITHUB_TOKEN)
+        self.rate_limiter = TokenBucket(capacity=5000, low_budget=LOW_BUDGET)
+        self.query_costs: Dict[str, int] = {}  # Last observed cost per query document
+        self.persisted_queries = persisted_queries
         print("✅ GitHub client initialized")
+    
+    async def __aenter__(self):
+        self.session = self._create_session()
+        return self
+    
+    def _create_session(self) -> httpx.AsyncClient:
+        """
+        Create the HTTP session used for every request.
+        
+        Why one long-lived session?
+        - HTTP/2 multiplexes requests over a single TLS connection
+        - Pooled connections are kept alive, so no new DNS lookup
+          or TCP/TLS handshake (~100-300 ms) per request
+        """
+        return httpx.AsyncClient(
+            http2=True,
+            headers=self.headers,
+            limits=httpx.Limits(
+                max_connections=20,
+                max_keepalive_connections=20,
+                keepalive_expiry=60  # Seconds an idle connection stays open
+            ),
+            timeout=30  # Fail if no response in 30s
+        )
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    async def close(self):
+        """Close the HTTP session and its pooled connections."""
+        if self.session:
+            await self.session.aclose()
+            self.session = None
+    
+    def _request_body(self, query: str, variables: Dict, include_query: bool = True) -> bytes:
+        """
+        Serialize a GraphQL request body.
         
-    def _execute_query(self, query: str, variables: Dict) -> Dict:
+        With persisted queries the body carries the query's hash, and the
+        query text only when `include_query` is set (after the server
+        answered PersistedQueryNotFound).
+        orjson serializes several times faster than stdlib json.
+        """
+        body = {"variables": variables}
+        if include_query:
+            body["query"] = query
+        if self.persisted_queries:
+            body["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": query_hash(query)}}
+        return orjson.dumps(body)
+    
+    def _persisted_query_not_found(self, data: Dict) -> bool:
+        """Check a GraphQL response for APQ's PersistedQueryNotFound error."""
+        return any(error.get('message') == 'PersistedQueryNotFound' for error in data.get('errors') or [])
+    
+    async def _execute_query(self, query: str, variables: Dict) -> Dict:
         """
         Execute GraphQL query with retry logic.
         
+        Before each request we take the query's expected cost from the
+        token bucket (see _expected_cost), which only makes us wait when
+        GitHub's budget runs low or is spent.
+        
         Why retry logic?
         - Network can fail temporarily
         - Rate limits need waiting
         - Improves reliability
         
-        Retry strategy: Exponential backoff
+        Retry strategy: Exponential backoff with jitter (see _retry_delay)
         - Attempt 1: Immediate
-        - Attempt 2: Wait 2 seconds
-        - Attempt 3: Wait 4 seconds
+        - Attempt 2: Wait up to 1 second
+        - Attempt 3: Wait up to 2 seconds
+        - Longer if the server sends Retry-After
+        
+        Waits use asyncio.sleep, so other requests keep running meanwhile.
         """
         max_retries = 3
+        include_query = not self.persisted_queries
         
         for attempt in range(max_retries):
             try:
-                response = requests.post(
-                    self.endpoint,
-                    json={"query": query, "variables": variables},
-                    headers=self.headers,
-                    timeout=30  # Fail if no response in 30s
-                )
-                
-                # GitHub sends rate limit info in headers
-                remaining = int(response.headers.get('X-RateLimit-Remaining', 0))
-                reset_time = int(response.headers.get('X-RateLimit-Reset', 0))
+                await self.rate_limiter.acquire(self._expected_cost(query))
+                async with self.semaphore:
+                    response = await self.session.post(
+                        self.endpoint,
+                        content=self._request_body(query, variables, include_query)
+                    )
                 
                 if response.status_code == 200:
-                    data = response.json()
+                    data = orjson.loads(response.content)
+                    
+                    # Server doesn't know our hash yet: send the full query
+                    if not include_query and self._persisted_query_not_found(data):
+                        include_query = True
+                        continue
+                    
+                    # Point budget spent: GitHub reports this as a GraphQL error
+                    if self._is_rate_limited(data):
+                        wait_time = self._rate_limit_wait()
+                        logger.warning("⏱️  Rate limit hit. Waiting %.0f seconds...", wait_time)
+                        await asyncio.sleep(wait_time)
+                        continue
                     
                     # Check for GraphQL errors (different from HTTP errors!)
                     if 'errors' in data:
-                        print(f"⚠️  GraphQL errors: {data['errors']}")
+                        logger.warning("⚠️  GraphQL errors: %s", data['errors'])
                         if attempt < max_retries - 1:
-                            print(f"Retrying in {2 ** attempt} seconds...")
-                            time.sleep(2 ** attempt)
+                            delay = self._retry_delay(attempt, response.headers.get('Retry-After'))
+                            logger.warning("Retrying in %.1f seconds...", delay)
+                            await asyncio.sleep(delay)
                             continue
                         else:
                             raise Exception(f"GraphQL errors: {data['errors']}")
                     
+                    self._reconcile_rate_limit(data, query)
                     return data
                 
                 # Handle rate limiting
-                if response.status_code == 403 or remaining == 0:
-                    wait_time = max(reset_time - time.time() + 10, 60)
-                    print(f"⏱️  Rate limit hit. Waiting {wait_time:.0f} seconds...")
-                    time.sleep(wait_time)
+                if response.status_code == 403:
+                    # Secondary rate limits say how long to back off
+                    retry_after = response.headers.get('Retry-After')
+                    wait_time = self._retry_delay(attempt, retry_after) if retry_after else self._rate_limit_wait()
+                    logger.warning("⏱️  Rate limit hit. Waiting %.0f seconds...", wait_time)
+                    await asyncio.sleep(wait_time)
                     continue
                 
                 # Handle other HTTP errors
@@ -90,79 +304,117 @@ class GitHubGraphQLClient:
                 
                 response.raise_for_status()
                 
-            except requests.exceptions.Timeout:
-                print(f"⚠️  Request timeout on attempt {attempt + 1}")
+            except httpx.TimeoutException:
+                logger.warning("⚠️  Request timeout on attempt %d", attempt + 1)
                 if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
+                    await asyncio.sleep(self._retry_delay(attempt))
                 else:
                     raise
             
-            except requests.exceptions.RequestException as e:
-                print(f"⚠️  Request failed on attempt {attempt + 1}: {e}")
+            # A truncated or garbled body is retried like a failed request
+            except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+                logger.warning("⚠️  Request failed on attempt %d: %s", attempt + 1, e)
                 if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
+                    failed = getattr(e, 'response', None)  # Only HTTP status errors carry one
+                    await asyncio.sleep(self._retry_delay(attempt, failed.headers.get('Retry-After') if failed is not None else None))
                 else:
                     raise
         
         raise Exception("Max retries exceeded")
     
-    def fetch_repositories(self, cursor: Optional[str] = None, batch_size: int = 100) -> Dict:
+    def _expected_cost(self, query: str) -> int:
+        """
+        Points the next request for `query` should reserve.
+        
+        GitHub prices a query by how many nodes its connections may return
+        (divided by 100, minimum 1), not by how many aliases it has, so we
+        reuse the `cost` last reported for the same document.
+        Unknown queries reserve 1 point until their first response.
+        """
+        return self.query_costs.get(query, 1)
+    
+    def _reconcile_rate_limit(self, data: Dict, query: str):
+        """
+        Sync the token bucket with the rateLimit data GitHub returned, if any.
+        
+        Why not the X-RateLimit-* headers?
+        - GraphQL is limited in points, the headers count requests
+        - The rateLimit field is the exact point budget we are spending
+        
+        Records the query's cost, hands remaining points and resetAt to the
+        token bucket, and resizes it when the response carries the hourly
+        `limit` (check_rate_limit asks for it).
+        """
+        rate_limit = (data.get('data') or {}).get('rateLimit')
+        if rate_limit:
+            if rate_limit.get('cost') is not None:
+                self.query_costs[query] = rate_limit['cost']
+            if rate_limit.get('limit'):
+                self.rate_limiter.resize(rate_limit['limit'])
+            reset_at = None
+            if rate_limit.get('resetAt'):
+                reset_at = datetime.fromisoformat(rate_limit['resetAt'].replace('Z', '+00:00')).timestamp()
+            self.rate_limiter.reconcile(rate_limit['remaining'], reset_at)
+    
+    def _retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
         """
-        Fetch repositories using GitHub's search.
+        Seconds to wait before retrying.
+        
+        Why jitter?
+        - Concurrent workers that fail together would otherwise all
+          retry at the same moment and fail together again
+        - "Full jitter": a random wait between 0 and 2^attempt seconds
         
-        Why search query "stars:>1"?
-        - Filters out repos with 0 stars
-        - Returns ANY repos with stars (not sorted)
-        - Gives us diverse sample
+        If the server sent Retry-After (seconds), we wait at least that long.
+        """
+        delay = random.uniform(0, 2 ** attempt)
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass  # HTTP-date form; GitHub sends seconds
+        return delay
+    
+    def _is_rate_limited(self, data: Dict) -> bool:
+        """Check a GraphQL response for a RATE_LIMITED error."""
+        return any(error.get('type') == 'RATE_LIMITED' for error in data.get('errors') or [])
+    
+    def _rate_limit_wait(self) -> float:
+        """Seconds to wait after hitting the rate limit: until reset, at least a minute."""
+        return max(self.rate_limiter.reset_at - time.time() + 10, 60)
+    
+    async def fetch_repository_batch(self, searches: List[Tuple[str, Optional[str]]],
+                                     batch_size: int = 100) -> Dict:
+        """
+        Fetch one page for each of several searches in a single request.
         
         Parameters:
-        - cursor: Pagination cursor (where to continue from)
-        - batch_size: How many repos per request (max 100)
+        - searches: (search query, cursor) pairs, e.g. ("stars:11..100", None)
+        - batch_size: How many repos per search (max 100)
         
         Returns:
-        - Dict with repos, pagination info, and rate limit data
-        """
-        
-        # GraphQL query
-        # Triple quotes allow multi-line strings
-        query = """
-        query($cursor: String, $batch_size: Int!) {
-          search(query: "stars:>1", type: REPOSITORY, first: $batch_size, after: $cursor) {
-            pageInfo {
-              hasNextPage
-              endCursor
-            }
-            nodes {
-              ... on Repository {
-                id
-                databaseId
-                name
-                nameWithOwner
-                owner {
-                  login
-                }
-                stargazerCount
-                createdAt
-                updatedAt
-              }
-            }
-          }
-          rateLimit {
-            remaining
-            resetAt
-            cost
-          }
-        }
+        - Dict whose data holds search0..searchN-1 (same order as `searches`)
+          plus rate limit data
         """
+        variables = {"batch_size": batch_size}
+        for i, (search_query, cursor) in enumerate(searches):
+            variables[f"query{i}"] = search_query
+            variables[f"cursor{i}"] = cursor
         
-        variables = {
-            "cursor": cursor,
-            "batch_size": batch_size
-        }
+        return await self._execute_query(build_search_batch_query(len(searches)), variables)
+    
+    async def count_repositories(self, search_queries: List[str]) -> List[int]:
+        """
+        Count the results of several searches in a single request.
         
-        return self._execute_query(query, variables)
+        Used to plan crawl shards (see crawler.shards.ShardPlanner).
+        Returns counts in the same order as `search_queries`.
+        """
+        variables = {f"query{i}": search_query for i, search_query in enumerate(search_queries)}
+        response = await self._execute_query(build_count_batch_query(len(search_queries)), variables)
+        return [response['data'][f"count{i}"]['repositoryCount'] for i in range(len(search_queries))]
     
-    def check_rate_limit(self) -> Dict:
+    async def check_rate_limit(self) -> Dict:
         """
         Check current rate limit status.
         
@@ -170,18 +422,7 @@ class GitHubGraphQLClient:
         - Monitoring before starting crawl
         - Debugging rate limit issues
         """
-        query = """
-        query {
-          rateLimit {
-            limit
-            remaining
-            resetAt
-            cost
-          }
-        }
-        """
-        
-        response = self._execute_query(query, {})
+        response = await self._execute_query(RATE_LIMIT_QUERY, {})
         rate_limit = response['data']['rateLimit']
         
         print(f"📊 Rate Limit Status:")
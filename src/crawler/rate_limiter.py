@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token-bucket limiter for GitHub's GraphQL point budget.
+    
+    Why a token bucket?
+    - GitHub budgets points (5000/hour), not requests
+    - The whole budget of a window can be spent at once, so we burst
+      while we have credit
+    - We only wait when the budget runs low, instead of sleeping a
+      fixed amount after every batch
+    
+    How does it refill?
+    - Like GitHub: the full budget comes back at `reset_at`, not bit by bit
+    - GitHub's resetAt replaces our estimate of `reset_at` whenever a
+      response reports it (see reconcile)
+    
+    Why pace a low budget?
+    - Bursting the last points and then stalling until reset wastes the
+      connection for most of an hour
+    - Below `low_budget` points, requests are spread evenly over the time
+      left until `reset_at`, so the budget lasts exactly that long
+    
+    Only used from the event loop, so it needs no lock.
+    """
+    
+    def __init__(self, capacity: int = 5000, window: float = 3600, low_budget: int = 0):
+        """
+        Parameters:
+        - capacity: Points per window (GitHub's hourly limit)
+        - window: Seconds between resets
+        - low_budget: Points left below which requests are paced
+        """
+        self.capacity = capacity
+        self.window = window
+        self.low_budget = low_budget
+        self.tokens = float(capacity)
+        self.reset_at = time.time() + window  # Epoch seconds, like GitHub's resetAt
+        self.next_slot = 0.0  # Earliest start of the next paced request
+    
+    def _refill(self, now: float):
+        """Restore the full budget once the window has reset."""
+        if now >= self.reset_at:
+            # Negative tokens are points already promised to waiting callers
+            self.tokens = min(self.capacity, self.tokens + self.capacity)
+            self.reset_at = now + self.window  # Estimate until GitHub reports it
+            self.next_slot = 0.0
+    
+    def _reserve(self, cost: float) -> float:
+        """
+        Take `cost` points and return how many seconds to wait before using them.
+        
+        Tokens may go negative: that is a queue of callers already waiting
+        for the reset, so they wait for the window their points come from.
+        """
+        now = time.time()
+        self._refill(now)
+        available = self.tokens
+        self.tokens -= cost
+        
+        if self.tokens < 0:
+            # Budget spent: wait for the reset that covers these points
+            windows_ahead = math.ceil(-self.tokens / self.capacity) - 1
+            return self.reset_at + windows_ahead * self.window - now
+        
+        if cost and available < self.low_budget:
+            # Spread what is left evenly over the time until reset
+            interval = (self.reset_at - now) * cost / available
+            start = max(now, self.next_slot)
+            self.next_slot = start + interval
+            return start - now
+        
+        return 0.0
+    
+    async def acquire(self, cost: float = 1):
+        """Wait (without blocking the event loop) until `cost` points may be spent."""
+        wait_time = self._reserve(cost)
+        if wait_time > 0:
+            if self.tokens < 0:
+                logger.warning("⏱️  Point budget spent. Waiting %.0f seconds...", wait_time)
+            else:
+                logger.debug("⏱️  Low point budget. Pacing request by %.1f seconds", wait_time)
+            await asyncio.sleep(wait_time)
+    
+    def resize(self, capacity: int):
+        """Adopt the real budget once GitHub reports it (tokens differ in their hourly limit)."""
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+    
+    def reconcile(self, remaining: int, reset_at: Optional[float] = None):
+        """Trust GitHub's remaining points and reset time over our estimates."""
+        self.tokens = float(remaining)
+        if reset_at:
+            self.reset_at = reset_at
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import math
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# GitHub's search returns at most this many results per query,
+# no matter how far you paginate.
+SEARCH_RESULT_CAP = 1000
+
+# Star counts above this are swept up by a single open-ended shard
+MAX_STARS = 1_000_000
+
+# How many counts to ask for in one aliased request
+COUNTS_PER_REQUEST = 20
+
+
+def star_query(low: int, high: Optional[int]) -> str:
+    """Search qualifier for repositories with low..high stars (high=None: no upper bound)."""
+    if high is None:
+        return f"stars:>={low}"
+    if low == high:
+        return f"stars:{low}"
+    return f"stars:{low}..{high}"
+
+
+class ShardPlanner:
+    """
+    Split "stars:>=min_stars" into searches that each fit under the search cap.
+    
+    Why?
+    - One search stops after 1000 results, so "stars:>1" alone can never
+      reach 100k repositories
+    - Disjoint star ranges with <= 1000 results each cover everything,
+      and can be crawled in parallel
+    
+    How?
+    - Count a range with repositoryCount (no repository data fetched)
+    - Too big? Split it at the geometric midpoint (stars are heavy-tailed,
+      so most repositories sit at the low end) and count both halves
+    - Counts for a whole round of ranges are fetched concurrently,
+      COUNTS_PER_REQUEST aliased searches per request
+    
+    Planning is incremental: plan(n) stops once its shards can yield n
+    repositories, and the ranges it has not counted or split yet stay
+    pending for the next call. Shards often return fewer repositories
+    than counted (deleted repos, null nodes), so the crawl asks for
+    more until it reaches its target or the planner is exhausted.
+    
+    A single star value can still exceed the cap (thousands of repositories
+    have exactly 2 stars); such shards are kept and crawled up to the cap.
+    If a count request fails, its ranges are kept unsplit as shards.
+    
+    Usage:
+        planner = ShardPlanner(client)
+        shards = await planner.plan(100000)
+    """
+    
+    def __init__(self, client, min_stars: int = 2):
+        """
+        Parameters:
+        - client: AsyncGitHubGraphQLClient used for the count requests
+        - min_stars: Lowest star count to crawl
+        """
+        self.client = client
+        # Star ranges not handed out as shards yet (high=None: no upper bound)
+        self.pending: List[Tuple[int, Optional[int]]] = [(MAX_STARS + 1, None), (min_stars, MAX_STARS)]
+    
+    @property
+    def exhausted(self) -> bool:
+        """True once every star range has been handed out as a shard."""
+        return not self.pending
+    
+    async def plan(self, target: int) -> List[str]:
+        """
+        Plan shards that can yield about `target` more repositories.
+        
+        Returns search qualifiers such as ["stars:>=1000001", "stars:5000..6200", "stars:7"],
+        or an empty list once the planner is exhausted.
+        """
+        shards: List[str] = []
+        covered = 0  # Repositories the planned shards can return
+        
+        while self.pending and covered < target:
+            chunks = [self.pending[i:i + COUNTS_PER_REQUEST]
+                      for i in range(0, len(self.pending), COUNTS_PER_REQUEST)]
+            counts = await asyncio.gather(
+                *[self.client.count_repositories([star_query(low, high) for low, high in chunk])
+                  for chunk in chunks],
+                return_exceptions=True
+            )
+            
+            self.pending = []
+            for chunk, chunk_counts in zip(chunks, counts):
+                if isinstance(chunk_counts, Exception):
+                    # Requests are already retried; crawl these ranges as they are
+                    logger.error("❌ Counting failed, keeping ranges unsplit: %s", chunk_counts)
+                    shards += [star_query(low, high) for low, high in chunk]
+                    continue
+                
+                for (low, high), count in zip(chunk, chunk_counts):
+                    if count == 0:
+                        continue
+                    
+                    # Open-ended tail and single star values cannot be split further
+                    if count <= SEARCH_RESULT_CAP or high is None or low == high:
+                        shards.append(star_query(low, high))
+                        covered += min(count, SEARCH_RESULT_CAP)
+                        continue
+                    
+                    middle = min(max(low, math.isqrt(low * high)), high - 1)
+                    self.pending += [(low, middle), (middle + 1, high)]
+        
+        # Also runs mid-crawl, whenever the shard pool runs dry
+        logger.info("🧩 Planned %d star-range shards (~%s repositories)", len(shards), f"{covered:,}")
+        return shards
@@ -1,9 +1,228 @@
 import os
 import sys
 import time
-from crawler.github_client import GitHubGraphQLClient
+import logging
+import asyncio
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple
+from crawler.github_client import AsyncGitHubGraphQLClient, ASYNC_CONCURRENCY
+from crawler.shards import ShardPlanner
 from db.connection import DatabaseManager
 
+logger = logging.getLogger(__name__)
+
+
+# How many shards one worker pages through together (aliased searches per request)
+SHARDS_PER_REQUEST = 4
+
+# How often a shard's request may fail (after the client's own retries)
+# before the crawl gives up on that shard
+MAX_SHARD_FAILURES = 3
+
+# Max batches waiting for the DB writer before fetchers pause
+WRITE_QUEUE_SIZE = 20
+
+# Minimum seconds between progress log lines
+PROGRESS_LOG_INTERVAL = 1.0
+
+
+def db_writer(db: DatabaseManager, writer_q: queue.Queue, target: int, stats: Dict):
+    """
+    Store batches from `writer_q` until a None sentinel arrives.
+    
+    Why a separate thread?
+    - psycopg2 calls block; on the event loop they would stall every
+      in-flight GitHub request while a batch is written or committed
+    - In a thread, DB writes overlap with network I/O
+    
+    Commits every db.commit_interval batches, and whatever is left once
+    the sentinel arrives. Repositories only count towards stats['stored']
+    and stats['new'] once their transaction has committed: a failed
+    commit rolls its batches back, so their counts are dropped.
+    
+    Progress is logged at most once per PROGRESS_LOG_INTERVAL: printing
+    every batch from a busy crawl mostly measures how fast stdout can flush.
+    """
+    start_time = time.time()
+    last_log = 0.0
+    uncommitted = {'stored': 0, 'new': 0}  # Written since the last commit
+    
+    def commit(final: bool = False):
+        try:
+            if final:
+                db.commit()
+            elif not db.batch_done():  # Commits every db.commit_interval batches
+                return
+        except Exception as e:
+            logger.error("❌ Commit failed, %s repositories rolled back: %s", f"{uncommitted['stored']:,}", e)
+        else:
+            stats['stored'] += uncommitted['stored']
+            stats['new'] += uncommitted['new']
+        uncommitted.update(stored=0, new=0)
+    
+    while True:
+        repos = writer_q.get()
+        if repos is None:  # All fetchers are done
+            commit(final=True)
+            return
+        
+        try:
+            # Store in database
+            stored, inserted = db.upsert_batch(repos)
+        except Exception as e:
+            logger.error("❌ Error storing batch: %s", e)
+            continue
+        
+        uncommitted['stored'] += stored
+        uncommitted['new'] += inserted
+        commit()
+        
+        # Progress update (sampled, including rows waiting for their commit)
+        if time.monotonic() - last_log < PROGRESS_LOG_INTERVAL:
+            continue
+        last_log = time.monotonic()
+        
+        total_repos = stats['stored'] + uncommitted['stored']
+        elapsed = time.time() - start_time
+        rate = total_repos / elapsed if elapsed > 0 else 0
+        remaining = target - total_repos
+        eta = remaining / rate if rate > 0 else 0
+        api_remaining = stats['rate_limit'].get('remaining', '?')
+        
+        logger.info("📈 Progress: %s/%s repos (%.1f%%) | Rate: %.1f repos/sec | "
+                    "ETA: %.1f minutes | API Rate Limit: %s remaining",
+                    f"{total_repos:,}", f"{target:,}", total_repos / target * 100,
+                    rate, eta / 60, api_remaining)
+
+
+async def crawl(client: AsyncGitHubGraphQLClient, db: DatabaseManager, planner: ShardPlanner,
+                shards: List[str], target: int, batch_size: int, stats: Dict):
+    """
+    Crawl repositories from many star-range shards in parallel.
+    
+    How?
+    - `client.concurrency` workers share one pool of shards (see ShardPlanner)
+    - Each worker pages through SHARDS_PER_REQUEST shards at a time,
+      one aliased request per page, following each shard's endCursor
+    - When the pool runs dry before the target is reached, an idle worker
+      asks the planner for more shards
+    - A failed request puts its shards back in the pool at the page they
+      had reached; a shard is dropped after MAX_SHARD_FAILURES failures
+    - All workers draw on the client's shared rate limit token bucket
+    - Workers hand batches to a DB writer thread through a bounded queue,
+      so DB latency hides behind network latency (see db_writer)
+    - When the writer falls behind the queue fills up and workers wait,
+      so memory stays bounded no matter how many requests are in flight
+    
+    Committed repositories are counted in stats['stored'] (stats['new']
+    for those new to the database) and the last rateLimit seen is kept
+    in stats['rate_limit']. The caller owns `stats`, so the counts
+    survive an interrupted crawl.
+    """
+    pool: List[Tuple[str, Optional[str]]] = [(shard, None) for shard in shards]  # (shard, cursor of its next page)
+    failures: Dict[str, int] = {}  # shard -> failed requests so far
+    abandoned: List[str] = []
+    planning = asyncio.Lock()  # One worker plans at a time
+    fetched = 0
+    
+    async def plan_more():
+        async with planning:
+            # Another worker may have refilled the pool while we waited
+            if not pool and not planner.exhausted and fetched < target:
+                pool.extend((shard, None) for shard in await planner.plan(target - fetched))
+    
+    async def fetcher():
+        nonlocal fetched
+        cursors: Dict[str, Optional[str]] = {}  # shard -> cursor of its next page
+        
+        while fetched < target:
+            if not cursors and not pool:
+                await plan_more()
+            
+            # Top up with fresh shards as ours run out
+            while len(cursors) < SHARDS_PER_REQUEST and pool:
+                shard, cursor = pool.pop()
+                cursors[shard] = cursor
+            if not cursors:
+                break
+            
+            searches = list(cursors.items())
+            
+            try:
+                response = await client.fetch_repository_batch(searches, batch_size)
+                stats['rate_limit'] = response['data'].get('rateLimit') or stats['rate_limit']
+                
+                for i, (shard, _) in enumerate(searches):
+                    search = response['data'][f"search{i}"]
+                    
+                    # Raw nodes go straight to the writer; null entries
+                    # are dropped while building DB rows
+                    if search['nodes']:
+                        fetched += len(search['nodes'])
+                        # Blocks (in a worker thread, not the event loop)
+                        # while the writer catches up
+                        await asyncio.to_thread(writer_q.put, search['nodes'])
+                    
+                    # Check if more pages exist
+                    if search['nodes'] and search['pageInfo']['hasNextPage']:
+                        cursors[shard] = search['pageInfo']['endCursor']
+                    else:
+                        del cursors[shard]
+                
+            except Exception as e:
+                # Requests are already retried; try these shards again later,
+                # from the page each had reached
+                logger.error("❌ Error during crawl: %s", e)
+                for shard, cursor in cursors.items():
+                    failures[shard] = failures.get(shard, 0) + 1
+                    if failures[shard] < MAX_SHARD_FAILURES:
+                        pool.insert(0, (shard, cursor))
+                    else:
+                        logger.warning("Giving up on shard %s", shard)
+                        abandoned.append(shard)
+                cursors.clear()
+                continue
+    
+    writer_q = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    writer_thread = threading.Thread(
+        target=db_writer, args=(db, writer_q, target, stats), daemon=True
+    )
+    writer_thread.start()
+    
+    try:
+        await asyncio.gather(*[fetcher() for _ in range(client.concurrency)])
+    finally:
+        # Let the writer drain what is queued, then stop it
+        await asyncio.to_thread(writer_q.put, None)
+        await asyncio.to_thread(writer_thread.join)
+    
+    if abandoned:
+        print(f"⚠️  Stopped short: gave up on {len(abandoned)} shards after repeated errors")
+    elif fetched < target and planner.exhausted:
+        print("✅ Reached end of available repositories")
+
+
+async def run(client: AsyncGitHubGraphQLClient, db: DatabaseManager,
+              target: int, batch_size: int, stats: Dict):
+    """Check the rate limit, plan shards, then crawl, sharing one HTTP session."""
+    async with client:
+        print("🔍 Checking GitHub API rate limit...")
+        await client.check_rate_limit()
+        print()
+        
+        print("🧩 Planning star-range shards...")
+        planner = ShardPlanner(client)
+        shards = await planner.plan(target)
+        print()
+        
+        print(f"📥 Starting crawl for {target:,} repositories...")
+        print(f"   Batch size: {batch_size} repos x {SHARDS_PER_REQUEST} shards/request")
+        print(f"   Concurrency: {client.concurrency} requests in flight")
+        print()
+        
+        await crawl(client, db, planner, shards, target, batch_size, stats)
+
 def main():
     """
     Main crawler orchestration.
@@ -16,6 +235,8 @@ def main():
     5. Export results
     """
     
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    
     print("=" * 60)
     print("🚀 GitHub Repository Crawler")
     print("=" * 60)
@@ -40,7 +261,7 @@ def main():
     
     # Step 2: Initialize clients
     try:
-        client = GitHubGraphQLClient(github_token)
+        client = AsyncGitHubGraphQLClient(github_token, ASYNC_CONCURRENCY)
         db = DatabaseManager(db_connection)
     except Exception as e:
         print(f"❌ Initialization failed: {e}")
@@ -58,88 +279,31 @@ def main():
         print(f"📊 Repositories in database: {initial_count}")
         print()
         
-        # Step 5: Check rate limit before starting
-        print("🔍 Checking GitHub API rate limit...")
-        client.check_rate_limit()
-        print()
-        
-        # Step 6: Crawl repositories
+        # Step 5 & 6: Check rate limit, then crawl repositories
         target = 100000  # Assignment requirement
-        total_repos = 0
-        cursor = None
         batch_size = 100  # Maximum allowed by GitHub GraphQL API
         
-        print(f"📥 Starting crawl for {target:,} repositories...")
-        print(f"   Batch size: {batch_size} repos/request")
-        print()
-        
         start_time = time.time()
+        stats = {'stored': 0, 'new': 0, 'rate_limit': {}}
+        interrupted = False
         
-        # Main crawling loop
-        while total_repos < target:
-            try:
-                # Fetch batch of repositories
-                response = client.fetch_repositories(cursor, batch_size)
-                
-                # Check if we got valid data
-                if 'data' not in response or not response['data']['search']['nodes']:
-                    print("⚠️  No more repositories found")
-                    break
-                
-                repos = response['data']['search']['nodes']
-                
-                # Filter out any null entries (sometimes happens with deleted repos)
-                repos = [r for r in repos if r and r.get('databaseId')]
-                
-                if not repos:
-                    print("⚠️  Empty batch, continuing...")
-                    continue
-                
-                # Store in database
-                db.upsert_repositories(repos)
-                db.insert_star_counts(repos)
-                
-                total_repos += len(repos)
-                
-                # Progress update
-                elapsed = time.time() - start_time
-                rate = total_repos / elapsed if elapsed > 0 else 0
-                remaining = target - total_repos
-                eta = remaining / rate if rate > 0 else 0
-                
-                print(f"📈 Progress: {total_repos:,}/{target:,} repos ({total_repos/target*100:.1f}%)")
-                print(f"   Rate: {rate:.1f} repos/sec | ETA: {eta/60:.1f} minutes")
-                
-                # Show rate limit info
-                if 'rateLimit' in response['data']:
-                    rate_limit = response['data']['rateLimit']
-                    print(f"   API Rate Limit: {rate_limit['remaining']} remaining")
-                
-                print()
-                
-                # Check if more pages exist
-                page_info = response['data']['search']['pageInfo']
-                if not page_info['hasNextPage']:
-                    print("✅ Reached end of available repositories")
-                    break
-                
-                cursor = page_info['endCursor']
-                
-                # Small delay to be nice to GitHub's servers
-                time.sleep(0.1)
-                
-            except KeyboardInterrupt:
-                print("\n⚠️  Crawl interrupted by user")
-                break
-                
-            except Exception as e:
-                print(f"❌ Error during crawl: {e}")
-                print("   Continuing to next batch...")
-                continue
+        try:
+            asyncio.run(run(client, db, target, batch_size, stats))
+        except KeyboardInterrupt:
+            print("\n⚠️  Crawl interrupted by user")
+            interrupted = True
+        # Repositories actually committed, also after an interrupt
+        total_repos = stats['stored']
         
         # Step 7: Summary
         elapsed_time = time.time() - start_time
-        final_count = db.get_total_repos()
+        # Counting new rows from the upserts saves a full COUNT(*) over the
+        # table; only an interrupted crawl (writer may not have finished)
+        # needs to query it
+        if interrupted:
+            final_count = db.get_total_repos()
+        else:
+            final_count = initial_count + stats['new']
         
         print("=" * 60)
         print("✅ Crawl Complete!")